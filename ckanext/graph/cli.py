@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-graph
+# Created by the Natural History Museum in London, UK
+
+import click
+
+from ckanext.graph.lib import snapshot
+
+
+def get_commands():
+    return [graph]
+
+
+@click.group()
+def graph():
+    """
+    Graph view commands.
+    """
+    pass
+
+
+@graph.command(name='clean-snapshots')
+def clean_snapshots():
+    """
+    Remove the stored snapshots of graph views that have been deleted.
+    """
+    removed = snapshot.remove_orphaned_snapshots()
+    click.echo(f'Removed the snapshots of {removed} deleted views')
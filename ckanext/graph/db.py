@@ -8,7 +8,10 @@ from abc import abstractmethod, abstractproperty
 
 from ckan.plugins import toolkit
 
-from ckanext.graph.lib import utils
+from ckanext.graph.lib import profile, utils
+
+# count fields with at most this many distinct values get exact term counts
+EXACT_TERMS_LIMIT = 1000
 
 
 class Query(object):
@@ -18,24 +21,52 @@ class Query(object):
     Subclass to implement different backend retrieval methods.
     """
 
-    def __init__(self, date_field=None, date_interval=None, count_field=None):
+    def __init__(
+        self,
+        date_field=None,
+        date_interval=None,
+        count_field=None,
+        resource=None,
+        filters=None,
+        q=None,
+    ):
         """
         Construct a new Query object. Use EITHER date args OR count args. Using both
         will fail.
 
         :param date_field: the name of the field to use for dates
-        :param date_interval: the length of time between date groupings, e.g. day, month
+        :param date_interval: the length of time between date groupings, e.g. day,
+            month; if not given, the backend chooses one
         :param count_field: the name of the field to use for categories
+        :param resource: the resource dict to query; if not given, the current
+            request's resource is used and the filters and q are taken from the request
+        :param filters: a dict of {field_name: [values]}, only used with resource
+        :param q: a query string, only used with resource
         """
         if date_field is not None:
             assert count_field is None
-        self.resource_id = toolkit.c.resource['id']
-        self.filters = utils.get_request_filters()
-        self.q = utils.get_request_query()
+        if resource is None:
+            self.resource = toolkit.c.resource
+            self.filters = utils.get_request_filters()
+            self.q = utils.get_request_query()
+        else:
+            self.resource = resource
+            self.filters = filters or {}
+            self.q = q
+        self.resource_id = self.resource['id']
         self.date_field = date_field
-        self.date_interval = date_interval or 'day'
         self.count_field = count_field
         self._is_date_query = date_field is not None
+        self.date_interval = date_interval or self._default_date_interval()
+
+    def _default_date_interval(self):
+        """
+        The date interval to use if one isn't given. Override this if the backend can
+        choose one based on the data.
+
+        :returns: the name of a date interval
+        """
+        return 'day'
 
     @property
     def query(self):
@@ -78,6 +109,17 @@ class Query(object):
         """
         pass
 
+    def iterate(self):
+        """
+        Submits the query to the backend and yields the results one at a time, so
+        callers don't need an intermediate list of (key, count) tuples. This doesn't
+        reduce the size of the backend's response, which may already be in memory in
+        full.
+
+        :returns: an iterator of (key, count) tuples
+        """
+        return iter(self.run())
+
     @classmethod
     def new(cls, *args, **kwargs):
         backend_type = toolkit.config.get('ckanext.graph.backend')
@@ -92,6 +134,14 @@ class ElasticSearchQuery(Query):
         self._bucket_name = 'query_buckets'
         self._aggregated_name = 'agg_buckets'
 
+    def _default_date_interval(self):
+        if not self._is_date_query:
+            return 'day'
+        # pick an interval that fits the field's date range into a sensible number of
+        # buckets
+        field_profile = profile.get_field_profile(self.date_field, self.resource)
+        return field_profile.default_interval if field_profile else 'day'
+
     def _nest(self, *query_stack):
         """
         Helper method for nesting multiple dicts inside each other (nested stacks can
@@ -145,9 +195,9 @@ class ElasticSearchQuery(Query):
 
     @property
     def _date_query(self):
-        field_type = utils.get_datastore_field_types()[self.date_field]
+        field_type = profile.get_field_types(self.resource)[self.date_field]
 
-        if field_type == 'date':
+        if field_type in profile.TEMPORAL_FIELD_TYPES:
             histogram_options = {'field': f'data.{self.date_field}._d'}
         else:
             script = f"""try {{
@@ -178,6 +228,11 @@ class ElasticSearchQuery(Query):
             'missing': toolkit._('Empty'),
         }
 
+        field_profile = profile.get_field_profile(self.count_field, self.resource)
+        if field_profile and 0 < field_profile.cardinality <= EXACT_TERMS_LIMIT:
+            # ask each shard for all of its terms so the top counts are exact
+            agg_options['shard_size'] = field_profile.cardinality
+
         query_stack = self._nest('aggs', self._bucket_name, 'terms', agg_options)
 
         if len(self.filters) > 0 or self.q is not None:
@@ -187,6 +242,9 @@ class ElasticSearchQuery(Query):
         return query_stack
 
     def run(self):
+        return list(self.iterate())
+
+    def iterate(self):
         # the vds_multi_direct action is admin only to prevent misuse, but we know what
         # we're doing, so skip the auth check
         context = {'ignore_auth': True}
@@ -199,8 +257,9 @@ class ElasticSearchQuery(Query):
         buckets = (aggs[self._aggregated_name] if extra_nesting else aggs)[
             self._bucket_name
         ]['buckets']
-        records = [(b['key'], b.get('doc_count', 0)) for b in buckets]
-        return records
+        # the parsed response (including every bucket) is already in memory, so this
+        # only avoids building a second list of records from it
+        return ((b['key'], b.get('doc_count', 0)) for b in buckets)
 
 
 class SqlQuery(Query):
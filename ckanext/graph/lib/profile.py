@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-graph
+# Created by the Natural History Museum in London, UK
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from ckan.plugins import toolkit
+
+from ckanext.graph.lib.utils import get_datastore_field_types
+
+log = logging.getLogger(__name__)
+
+# the maximum number of resource versions to keep profiles for in memory
+CACHE_SIZE = 100
+
+# the default number of seconds cached profiles are used for (see get_cache_ttl)
+CACHE_TTL = 3600
+
+# the number of docs per shard used to estimate the date parse rate of non-date fields
+SAMPLE_SIZE = 10000
+
+TEMPORAL_FIELD_TYPES = ['date']
+
+# the approximate length of each date interval in milliseconds, shortest first
+INTERVAL_LENGTHS = OrderedDict(
+    [
+        ('minute', 60 * 1000),
+        ('hour', 60 * 60 * 1000),
+        ('day', 24 * 60 * 60 * 1000),
+        ('month', 30 * 24 * 60 * 60 * 1000),
+        ('year', 365 * 24 * 60 * 60 * 1000),
+    ]
+)
+
+# the maximum number of buckets a default date interval should produce
+MAX_DATE_BUCKETS = 1000
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class FieldProfile(object):
+    """
+    Statistics about a single datastore field, computed once per resource version.
+    """
+
+    def __init__(
+        self,
+        name,
+        field_type,
+        count=0,
+        cardinality=0,
+        parse_rate=0.0,
+        min_value=None,
+        max_value=None,
+    ):
+        """
+        :param name: the name of the field
+        :param field_type: the datastore type of the field
+        :param count: the number of records with a value in this field
+        :param cardinality: an estimate of the number of distinct values in this field
+        :param parse_rate: the proportion of (sampled) values that can be parsed as a
+            date, between 0 and 1
+        :param min_value: the earliest date in the field, as a millisecond timestamp;
+            for non-date fields this only comes from the sampled values
+        :param max_value: the latest date in the field, as a millisecond timestamp;
+            for non-date fields this only comes from the sampled values
+        """
+        self.name = name
+        self.field_type = field_type
+        self.count = count
+        self.cardinality = cardinality
+        self.parse_rate = parse_rate
+        self.min_value = min_value
+        self.max_value = max_value
+
+    @property
+    def is_temporal(self):
+        """
+        Whether the field can be used as a date field.
+
+        :returns: True if the field is a date type or contains parseable dates
+        """
+        return self.field_type in TEMPORAL_FIELD_TYPES or self.parse_rate > 0
+
+    @property
+    def date_range(self):
+        """
+        The date range covered by the field, if known.
+
+        :returns: a (min, max) tuple of millisecond timestamps, or None
+        """
+        if self.min_value is None or self.max_value is None:
+            return None
+        return self.min_value, self.max_value
+
+    @property
+    def default_interval(self):
+        """
+        The shortest date interval that covers the field's date range in at most
+        MAX_DATE_BUCKETS buckets. For non-date fields the range is estimated from a
+        sample of SAMPLE_SIZE docs per shard, so the real data can be wider and produce
+        more buckets than this.
+
+        :returns: the name of a date interval, e.g. day
+        """
+        if self.date_range is None:
+            return 'day'
+        span = self.max_value - self.min_value
+        for interval, length in INTERVAL_LENGTHS.items():
+            if span / length <= MAX_DATE_BUCKETS:
+                return interval
+        return 'year'
+
+
+def _parse_script(field_name, success, failure):
+    """
+    Painless script that parses the given field's value as a yyyy-MM-dd date.
+
+    :param field_name: the name of the field
+    :param success: the expression to return if the value parses; can use dt
+    :param failure: the expression to return if the value doesn't parse
+    :returns: the script source
+    """
+    return f"""try {{
+      def parser = new SimpleDateFormat('yyyy-MM-dd');
+      def dt = parser.parse(doc['data.{field_name}'].value);
+      return {success};
+     }} catch (Exception e) {{
+      return {failure};
+     }}"""
+
+
+def build_profile_query(field_types):
+    """
+    Build a single elasticsearch aggregation request that profiles every field at
+    once. Aggregation names use the field's index rather than its name, as field names
+    may contain characters elasticsearch doesn't allow in aggregation names.
+
+    :param field_types: a dict of {field_name: field_type}
+    :returns: a search body ready to submit to vds_multi_direct
+    """
+    aggs = {}
+    sampled = {}
+
+    for i, (field_name, field_type) in enumerate(field_types.items()):
+        field = f'data.{field_name}'
+        aggs[f'f{i}_count'] = {'value_count': {'field': field}}
+        aggs[f'f{i}_cardinality'] = {'cardinality': {'field': field}}
+
+        if field_type in TEMPORAL_FIELD_TYPES:
+            aggs[f'f{i}_min'] = {'min': {'field': f'{field}._d'}}
+            aggs[f'f{i}_max'] = {'max': {'field': f'{field}._d'}}
+        else:
+            script = _parse_script(field_name, 'dt.getTime()', 'null')
+            parsed_filter = {
+                'script': {
+                    'script': {'source': _parse_script(field_name, 'true', 'false')}
+                }
+            }
+            sampled[f'f{i}_exists'] = {'filter': {'exists': {'field': field}}}
+            sampled[f'f{i}_parsed'] = {
+                'filter': parsed_filter,
+                'aggs': {
+                    'min': {'min': {'script': {'source': script}}},
+                    'max': {'max': {'script': {'source': script}}},
+                },
+            }
+
+    if sampled:
+        aggs['sample'] = {
+            'sampler': {'shard_size': SAMPLE_SIZE},
+            'aggs': sampled,
+        }
+
+    return {'size': 0, 'aggs': aggs}
+
+
+def parse_profile_results(field_types, aggregations):
+    """
+    Convert the aggregation results from a profile query into FieldProfile objects.
+
+    :param field_types: the dict of {field_name: field_type} used to build the query
+    :param aggregations: the aggregations dict from the search response
+    :returns: a dict of {field_name: FieldProfile}
+    """
+    sample = aggregations.get('sample', {})
+    profiles = {}
+
+    for i, (field_name, field_type) in enumerate(field_types.items()):
+        profile = FieldProfile(
+            field_name,
+            field_type,
+            count=aggregations.get(f'f{i}_count', {}).get('value', 0),
+            cardinality=aggregations.get(f'f{i}_cardinality', {}).get('value', 0),
+        )
+
+        if field_type in TEMPORAL_FIELD_TYPES:
+            profile.parse_rate = 1.0 if profile.count else 0.0
+            profile.min_value = aggregations.get(f'f{i}_min', {}).get('value')
+            profile.max_value = aggregations.get(f'f{i}_max', {}).get('value')
+        else:
+            exists = sample.get(f'f{i}_exists', {}).get('doc_count', 0)
+            parsed = sample.get(f'f{i}_parsed', {})
+            if exists and parsed.get('doc_count', 0):
+                profile.parse_rate = parsed['doc_count'] / exists
+                profile.min_value = parsed.get('min', {}).get('value')
+                profile.max_value = parsed.get('max', {}).get('value')
+
+        profiles[field_name] = profile
+
+    return profiles
+
+
+def get_resource_version(resource):
+    """
+    Get a key identifying the current version of the resource's data.
+
+    Datastore ingests and upserts don't always update the resource's modification
+    times, so this can stay the same when the data changes; cached values keyed on it
+    should also expire after get_cache_ttl seconds.
+
+    :param resource: the resource dict
+    :returns: a (resource_id, version) tuple
+    """
+    version = resource.get('last_modified') or resource.get('metadata_modified')
+    return resource['id'], version
+
+
+def get_cache_ttl():
+    """
+    Get the number of seconds cached profiles (and snapshots) are used for, from
+    ckanext.graph.cache_ttl.
+
+    :returns: the ttl in seconds
+    """
+    return int(toolkit.config.get('ckanext.graph.cache_ttl', CACHE_TTL))
+
+
+def _get_entry(resource):
+    """
+    Get the cache entry for the current version of the resource, creating it (and
+    retrieving the field types) if it is missing or has expired.
+
+    :param resource: the resource dict
+    :returns: a dict with the field_types and the profiles computed so far
+    """
+    key = get_resource_version(resource)
+    now = time.time()
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and now - entry['created'] < get_cache_ttl():
+            _cache.move_to_end(key)
+            return entry
+
+    # profiles are shared between users and background jobs have no user at all, so
+    # skip the auth check (the field names are only shown to users who can see the view)
+    field_types = get_datastore_field_types(resource['id'], {'ignore_auth': True})
+    entry = {'created': now, 'field_types': field_types, 'profiles': {}}
+
+    with _cache_lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return entry
+
+
+def _profile_fields(resource_id, field_types):
+    """
+    Profile the given fields in one aggregation.
+
+    :param resource_id: the id of the resource
+    :param field_types: a dict of {field_name: field_type} to profile
+    :returns: a dict of {field_name: FieldProfile}, or None if the backend failed
+    """
+    # the vds_multi_direct action is admin only to prevent misuse, but we know what
+    # we're doing, so skip the auth check
+    context = {'ignore_auth': True}
+    data_dict = {
+        'resource_ids': [resource_id],
+        'search': build_profile_query(field_types),
+    }
+    try:
+        results = toolkit.get_action('vds_multi_direct')(context, data_dict)
+    except Exception:
+        log.warning(
+            f'Failed to profile fields for resource {resource_id}', exc_info=True
+        )
+        return None
+    return parse_profile_results(field_types, results.get('aggregations', {}))
+
+
+def get_field_types(resource=None):
+    """
+    Get the datastore field types for a resource, cached with the profiles. This
+    doesn't run any aggregations.
+
+    :param resource: the resource dict; defaults to the current request's resource
+    :returns: a dict of {field_name: field_type}
+    """
+    return _get_entry(resource or toolkit.c.resource)['field_types']
+
+
+def get_field_profiles(resource=None, fields=None):
+    """
+    Get the profiles for fields in a resource. Any fields that haven't been profiled
+    yet are computed in one batched aggregation, and the results are cached per
+    resource version, so this is cheap to call repeatedly. If the backend fails,
+    uncached profiles containing only the field types are returned.
+
+    :param resource: the resource dict; defaults to the current request's resource
+    :param fields: the names of the fields to profile; defaults to every field
+    :returns: a dict of {field_name: FieldProfile}
+    """
+    resource = resource or toolkit.c.resource
+    entry = _get_entry(resource)
+    field_types = entry['field_types']
+
+    if fields is None:
+        fields = list(field_types)
+    else:
+        fields = [field_name for field_name in fields if field_name in field_types]
+
+    with _cache_lock:
+        missing = {
+            field_name: field_types[field_name]
+            for field_name in fields
+            if field_name not in entry['profiles']
+        }
+
+    if missing:
+        profiles = _profile_fields(resource['id'], missing)
+        if profiles is None:
+            # fall back to profiles containing only the field types; these aren't
+            # cached so the next call tries the backend again
+            profiles = {
+                field_name: FieldProfile(field_name, field_type)
+                for field_name, field_type in missing.items()
+            }
+            return {
+                field_name: entry['profiles'].get(field_name) or profiles[field_name]
+                for field_name in fields
+            }
+        with _cache_lock:
+            entry['profiles'].update(profiles)
+
+    return {field_name: entry['profiles'][field_name] for field_name in fields}
+
+
+def get_field_profile(field_name, resource=None):
+    """
+    Get the profile for a single field in a resource.
+
+    :param field_name: the name of the field
+    :param resource: the resource dict; defaults to the current request's resource
+    :returns: a FieldProfile, or None if the field doesn't exist
+    """
+    return get_field_profiles(resource, [field_name]).get(field_name)
+
+
+def clear_cache():
+    """
+    Remove all cached profiles.
+    """
+    with _cache_lock:
+        _cache.clear()
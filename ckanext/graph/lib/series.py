@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-graph
+# Created by the Natural History Museum in London, UK
+
+from array import array
+from io import StringIO
+from itertools import accumulate
+
+
+class DateSeries(object):
+    """
+    A compact, array-backed store for date histogram buckets. Only the timestamps and
+    per-bucket counts are kept; the cumulative totals are computed on the fly when
+    encoding. This replaces the separate [timestamp, value] lists for the total and
+    per-interval graphs, but the backend response the buckets are read from is still
+    held in memory while the series is built.
+    """
+
+    def __init__(self, records=None):
+        """
+        :param records: an optional iterable of (timestamp, count) tuples to add
+        """
+        self.timestamps = array('q')
+        self.counts = array('q')
+        if records is not None:
+            self.extend(records)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def extend(self, records):
+        """
+        Add buckets to the series.
+
+        :param records: an iterable of (timestamp, count) tuples
+        """
+        for timestamp, count in records:
+            self.timestamps.append(int(timestamp))
+            self.counts.append(int(count))
+
+    def encode_counts(self):
+        """
+        Encode the per-bucket counts as a JSON list of [timestamp, count] pairs.
+
+        :returns: a JSON string
+        """
+        return encode_pairs(self.timestamps, self.counts)
+
+    def encode_totals(self):
+        """
+        Encode the running totals as a JSON list of [timestamp, total] pairs.
+
+        :returns: a JSON string
+        """
+        return encode_pairs(self.timestamps, accumulate(self.counts))
+
+
+def encode_pairs(xs, ys):
+    """
+    Encode two parallel sequences of integers as a JSON list of [x, y] pairs without
+    building the intermediate list of lists.
+
+    :param xs: an iterable of integers
+    :param ys: an iterable of integers
+    :returns: a JSON string
+    """
+    output = StringIO()
+    output.write('[')
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        if i:
+            output.write(', ')
+        output.write(f'[{x}, {y}]')
+    output.write(']')
+    return output.getvalue()
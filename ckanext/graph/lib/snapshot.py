@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-graph
+# Created by the Natural History Museum in London, UK
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+from itertools import accumulate, islice
+from xml.sax.saxutils import escape
+
+from ckan.plugins import toolkit
+
+from ckanext.graph.db import Query
+from ckanext.graph.lib import profile
+from ckanext.graph.lib.series import DateSeries
+
+WIDTH = 600
+PANEL_HEIGHT = 220
+TITLE_HEIGHT = 30
+MARGIN = 40
+COLOUR = '#edc240'
+
+# the maximum number of bars/points drawn per panel; anything longer is downsampled
+MAX_POINTS = 300
+
+# seconds after which a render that hasn't finished is assumed to have been lost
+PENDING_TTL = 600
+
+# the view options that affect what is drawn
+VIEW_OPTIONS = [
+    'show_date',
+    'date_field',
+    'date_interval',
+    'show_count',
+    'count_field',
+    'count_label',
+    'filters',
+]
+
+
+def get_snapshot_dir():
+    """
+    Get the directory snapshots are stored in, from ckanext.graph.snapshot_path or a
+    subdirectory of ckan.storage_path.
+
+    :returns: the directory path, or None if snapshots are not configured
+    """
+    path = toolkit.config.get('ckanext.graph.snapshot_path')
+    if not path:
+        storage_path = toolkit.config.get('ckan.storage_path')
+        if not storage_path:
+            return None
+        path = os.path.join(storage_path, 'graph_snapshots')
+    return path
+
+
+def get_snapshot_path(resource_view, resource):
+    """
+    Get the path of the snapshot for the current version of the view and resource.
+    Changing either the resource data or the view options (including the view's saved
+    filters) changes the path.
+
+    :param resource_view: the resource view dict
+    :param resource: the resource dict
+    :returns: the file path, or None if snapshots are not configured
+    """
+    directory = get_snapshot_dir()
+    if directory is None:
+        return None
+    _, version = profile.get_resource_version(resource)
+    options = {option: resource_view.get(option) for option in VIEW_OPTIONS}
+    key = json.dumps([version, options], sort_keys=True, default=str)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(directory, resource_view['id'], f'{digest}.svg')
+
+
+def get_panels(resource_view, resource):
+    """
+    Run the view's queries with its saved filters (but not any request filters) and
+    collect the values to draw.
+
+    :param resource_view: the resource view dict
+    :param resource: the resource dict
+    :returns: a list of panel dicts with title, kind (bar or line), values and labels;
+        line panels draw the running total of their values
+    """
+    panels = []
+    filters = resource_view.get('filters') or {}
+
+    if resource_view.get('show_count') and resource_view.get('count_field'):
+        count_field = resource_view['count_field']
+        records = Query.new(
+            count_field=count_field, resource=resource, filters=filters
+        ).run()
+        if records:
+            panels.append(
+                {
+                    'title': resource_view.get('count_label') or count_field,
+                    'kind': 'bar',
+                    'values': [count for _, count in records],
+                    'labels': [str(key).title() for key, _ in records],
+                }
+            )
+
+    if resource_view.get('show_date') and resource_view.get('date_field'):
+        date_query = Query.new(
+            date_field=resource_view['date_field'],
+            date_interval=resource_view.get('date_interval'),
+            resource=resource,
+            filters=filters,
+        )
+        date_interval = date_query.date_interval
+        series = DateSeries(date_query.iterate())
+        if series:
+            # both panels use the series' counts array directly rather than copying it
+            panels.append(
+                {
+                    'title': 'Total records',
+                    'kind': 'line',
+                    'values': series.counts,
+                    'labels': None,
+                }
+            )
+            panels.append(
+                {
+                    'title': 'Per %s' % date_interval,
+                    'kind': 'bar',
+                    'values': series.counts,
+                    'labels': None,
+                }
+            )
+
+    return panels
+
+
+def _downsample(values):
+    """
+    Reduce a sequence of values to at most MAX_POINTS by summing consecutive chunks.
+    The values are read in place, without copying the whole sequence.
+
+    :param values: a sequence of numbers, e.g. a list or an array
+    :returns: a list of numbers
+    """
+    if len(values) <= MAX_POINTS:
+        return list(values)
+    size = math.ceil(len(values) / MAX_POINTS)
+    iterator = iter(values)
+    return [sum(islice(iterator, size)) for _ in range(math.ceil(len(values) / size))]
+
+
+def _render_panel(panel, top):
+    """
+    Render a single panel as SVG elements.
+
+    :param panel: a panel dict
+    :param top: the y offset of the panel
+    :returns: a list of SVG element strings
+    """
+    elements = [
+        f'<text x="{MARGIN}" y="{top + 20}" font-size="16">'
+        f'{escape(panel["title"])}</text>'
+    ]
+
+    values = _downsample(panel['values'])
+    if panel['kind'] == 'line':
+        # the running total of the chunk sums is the total at the end of each chunk
+        values = list(accumulate(values))
+    labels = panel['labels'] if len(values) == len(panel['values']) else None
+
+    plot_top = top + TITLE_HEIGHT
+    plot_height = PANEL_HEIGHT - TITLE_HEIGHT - MARGIN
+    plot_width = WIDTH - 2 * MARGIN
+    baseline = plot_top + plot_height
+    maximum = max(values) or 1
+    step = plot_width / len(values)
+
+    def _y(value):
+        return baseline - value / maximum * plot_height
+
+    elements.append(
+        f'<line x1="{MARGIN}" y1="{baseline}" x2="{WIDTH - MARGIN}" y2="{baseline}" '
+        f'stroke="#545454"/>'
+    )
+    elements.append(
+        f'<text x="{MARGIN - 4}" y="{plot_top + 4}" font-size="10" '
+        f'text-anchor="end">{maximum}</text>'
+    )
+
+    if panel['kind'] == 'line':
+        points = ' '.join(
+            f'{MARGIN + (i + 0.5) * step:.1f},{_y(value):.1f}'
+            for i, value in enumerate(values)
+        )
+        elements.append(
+            f'<polyline points="{points}" fill="none" stroke="{COLOUR}" '
+            f'stroke-width="2"/>'
+        )
+    else:
+        bar_width = step * 0.6
+        for i, value in enumerate(values):
+            x = MARGIN + (i + 0.2) * step
+            y = _y(value)
+            elements.append(
+                f'<rect x="{x:.1f}" y="{y:.1f}" width="{bar_width:.1f}" '
+                f'height="{baseline - y:.1f}" fill="{COLOUR}"/>'
+            )
+            if labels:
+                elements.append(
+                    f'<text x="{x + bar_width / 2:.1f}" y="{baseline + 12}" '
+                    f'font-size="10" text-anchor="middle">{escape(labels[i])}</text>'
+                )
+
+    return elements
+
+
+def render_svg(panels):
+    """
+    Render the panels into a single static SVG, stacked vertically.
+
+    :param panels: a list of panel dicts, as returned by get_panels
+    :returns: the SVG as a string
+    """
+    height = PANEL_HEIGHT * max(len(panels), 1)
+    elements = []
+    for i, panel in enumerate(panels):
+        elements.extend(_render_panel(panel, i * PANEL_HEIGHT))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{height}" '
+        f'viewBox="0 0 {WIDTH} {height}" font-family="sans-serif">'
+        + ''.join(elements)
+        + '</svg>'
+    )
+
+
+def _remove(path):
+    """
+    Remove a file if it exists.
+
+    :param path: the file path
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _is_fresh(path, ttl):
+    """
+    Check whether a file exists and was modified less than ttl seconds ago.
+
+    :param path: the file path
+    :param ttl: the maximum age in seconds
+    :returns: True if the file is fresh, False if not
+    """
+    try:
+        return time.time() - os.path.getmtime(path) < ttl
+    except FileNotFoundError:
+        return False
+
+
+def _get_latest_snapshot(directory):
+    """
+    Find the most recently written snapshot in a view's snapshot directory.
+
+    :param directory: the view's snapshot directory
+    :returns: the path of the snapshot, or None if there aren't any
+    """
+    if not os.path.isdir(directory):
+        return None
+    snapshots = [
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith('.svg')
+    ]
+    return max(snapshots, key=os.path.getmtime, default=None)
+
+
+def _remove_superseded(path):
+    """
+    Remove every snapshot and failure marker in a view's snapshot directory except the
+    given snapshot.
+
+    :param path: the path of the current snapshot
+    """
+    directory, current = os.path.split(path)
+    for name in os.listdir(directory):
+        if name != current and name.endswith(('.svg', '.failed')):
+            _remove(os.path.join(directory, name))
+
+
+def generate_snapshot(resource_view_id, path):
+    """
+    Background job that renders a view's snapshot and writes it to the given path. Any
+    older snapshots of the view are removed once the new one is written. If rendering
+    fails, a failure marker is written so the render isn't queued again on every
+    request.
+
+    :param resource_view_id: the id of the resource view
+    :param path: the path to write the snapshot to
+    """
+    context = {'ignore_auth': True}
+    try:
+        resource_view = toolkit.get_action('resource_view_show')(
+            context, {'id': resource_view_id}
+        )
+        resource = toolkit.get_action('resource_show')(
+            context, {'id': resource_view['resource_id']}
+        )
+        svg = render_svg(get_panels(resource_view, resource))
+        # write to a temporary file first so a partial snapshot is never served
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(svg)
+        os.replace(f'{path}.tmp', path)
+        _remove_superseded(path)
+    except Exception as e:
+        _remove(f'{path}.tmp')
+        with open(f'{path}.failed', 'w') as f:
+            f.write(str(e))
+        raise
+    finally:
+        _remove(f'{path}.pending')
+
+
+def _queue_render(resource_view, path):
+    """
+    Queue a background job to render the snapshot, unless one is already pending or
+    the last attempt failed less than get_cache_ttl seconds ago.
+
+    :param resource_view: the resource view dict
+    :param path: the path to render the snapshot to
+    """
+    if _is_fresh(f'{path}.failed', profile.get_cache_ttl()):
+        return
+
+    pending = f'{path}.pending'
+    if os.path.exists(pending) and not _is_fresh(pending, PENDING_TTL):
+        # the job was lost or its worker was killed, so let it be queued again
+        _remove(pending)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        # the pending marker is created atomically, so only one job is queued at once
+        os.close(os.open(pending, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return
+
+    try:
+        toolkit.enqueue_job(
+            generate_snapshot,
+            [resource_view['id'], path],
+            title=f'Render graph snapshot for view {resource_view["id"]}',
+        )
+    except Exception:
+        _remove(pending)
+        raise
+
+
+def request_snapshot(resource_view, resource):
+    """
+    Get the path of the view's snapshot. If the snapshot for the current version is
+    missing or older than get_cache_ttl seconds, a background job is queued to render
+    it and the newest existing snapshot of the view is returned in the meantime.
+
+    :param resource_view: the resource view dict
+    :param resource: the resource dict
+    :returns: the path of the snapshot, or None if there isn't one yet
+    """
+    path = get_snapshot_path(resource_view, resource)
+    if path is None:
+        return None
+    if _is_fresh(path, profile.get_cache_ttl()):
+        return path
+
+    _queue_render(resource_view, path)
+    return _get_latest_snapshot(os.path.dirname(path))
+
+
+def remove_orphaned_snapshots():
+    """
+    Remove the snapshots of views that no longer exist.
+
+    :returns: the number of views whose snapshots were removed
+    """
+    directory = get_snapshot_dir()
+    if directory is None or not os.path.isdir(directory):
+        return 0
+
+    removed = 0
+    context = {'ignore_auth': True}
+    for view_id in os.listdir(directory):
+        try:
+            toolkit.get_action('resource_view_show')(context, {'id': view_id})
+        except toolkit.ObjectNotFound:
+            shutil.rmtree(os.path.join(directory, view_id), ignore_errors=True)
+            removed += 1
+    return removed
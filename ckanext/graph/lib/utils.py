@@ -8,17 +8,20 @@ from urllib.parse import unquote
 from ckan.plugins import toolkit
 
 
-def get_datastore_field_types():
+def get_datastore_field_types(resource_id=None, context=None):
     """
     Get a dict of datastore field names and their types.
 
+    :param resource_id: the resource to get the fields for; defaults to the current
+        request's resource
+    :param context: the context to call datastore_search with; defaults to an empty one
     :returns: a dict of {field_name: field_type}
     """
     data = {
-        'resource_id': toolkit.c.resource['id'],
+        'resource_id': resource_id or toolkit.c.resource['id'],
         'limit': 0,
     }
-    results = toolkit.get_action('datastore_search')({}, data)
+    results = toolkit.get_action('datastore_search')(context or {}, data)
     return {field['id']: field['type'] for field in results.get('fields', [])}
 
 
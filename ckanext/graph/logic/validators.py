@@ -7,7 +7,7 @@
 from ckan.plugins import toolkit
 from sqlalchemy.exc import DataError
 
-from ckanext.graph.lib import utils
+from ckanext.graph.lib import profile
 
 
 def is_boolean(value, context):
@@ -49,53 +49,59 @@ def in_list(list_possible_values):
     return validate
 
 
+def _has_castable_dates(field_name):
+    """
+    Check every record in the current resource for a value in the given field that can
+    be cast to a date.
+
+    :param field_name: the name of the field
+    :returns: True if at least one value can be cast, False if not
+    """
+    script = """
+    if (doc['data.{date_field_name}'].value != null) {{
+     try {{
+      new SimpleDateFormat('yyyy-MM-dd').parse(doc['data.{date_field_name}'].value);
+      return true;
+     }} catch (Exception e) {{
+      return false;
+     }}
+    }} else {{
+     return false;
+    }}
+    """.format(date_field_name=field_name)
+
+    data_dict = {
+        'search': {
+            'query': {'bool': {'filter': {'script': {'script': {'source': script}}}}}
+        },
+        'resource_id': toolkit.c.resource['id'],
+    }
+
+    try:
+        result = toolkit.get_action('datastore_search_raw')({}, data_dict)
+    except DataError:
+        return False
+    return result['total'] > 0
+
+
 def is_date_castable(value, context):
     """
-    Validator to ensure the date is castable to a date field.
+    Validator to ensure the date is castable to a date field. The cached field profile
+    is checked first; as it only samples the records, a full scan is run if no dates
+    were found in the sample.
 
     :param value:
     :param context:
     """
 
     if value:
-        fields = utils.get_datastore_field_types()
-
-        field_type = fields[value]
-
-        if field_type == 'date':
-            return value
-        else:
-            script = """
-            if (doc['data.{date_field_name}'].value != null) {{
-             try {{
-              new SimpleDateFormat('yyyy-MM-dd').parse(doc['data.{date_field_name}'].value);
-              return true;
-             }} catch (Exception e) {{
-              return false;
-             }}
-            }} else {{
-             return false;
-            }}
-            """.format(date_field_name=value)
-
-            data_dict = {
-                'search': {
-                    'query': {
-                        'bool': {'filter': {'script': {'script': {'source': script}}}}
-                    }
-                },
-                'resource_id': toolkit.c.resource['id'],
-            }
-
-            failure = toolkit.Invalid(
+        field_profile = profile.get_field_profile(value)
+
+        if field_profile is None or not (
+            field_profile.is_temporal or _has_castable_dates(value)
+        ):
+            raise toolkit.Invalid(
                 f"Field {value} cannot be cast into a date. Are you sure it's a date field?"
             )
 
-            try:
-                result = toolkit.get_action('datastore_search_raw')({}, data_dict)
-                if result['total'] == 0:
-                    raise failure
-            except DataError:
-                raise failure
-
     return value
@@ -9,19 +9,18 @@ import logging
 from ckan.plugins import SingletonPlugin, implements, interfaces, toolkit
 
 import ckanext.datastore.interfaces as datastore_interfaces
+from ckanext.graph import cli, routes
 from ckanext.graph.db import Query
-from ckanext.graph.lib import utils
+from ckanext.graph.lib import profile
+from ckanext.graph.lib.series import DateSeries
 from ckanext.graph.logic.validators import in_list, is_boolean, is_date_castable
 
-not_empty = toolkit.get_validator('not_empty')
 ignore_empty = toolkit.get_validator('ignore_empty')
 
 log = logging.getLogger(__name__)
 
 DATE_INTERVALS = ['minute', 'hour', 'day', 'month', 'year']
 
-TEMPORAL_FIELD_TYPES = ['date']
-
 
 class GraphPlugin(SingletonPlugin):
     """
@@ -29,6 +28,9 @@ class GraphPlugin(SingletonPlugin):
     """
 
     implements(interfaces.IConfigurer)
+    implements(interfaces.IBlueprint, inherit=True)
+    implements(interfaces.IClick)
+    implements(interfaces.ITemplateHelpers, inherit=True)
     implements(interfaces.IResourceView, inherit=True)
     implements(datastore_interfaces.IDatastore, inherit=True)
     datastore_field_names = []
@@ -43,6 +45,48 @@ class GraphPlugin(SingletonPlugin):
         toolkit.add_template_directory(config, 'theme/templates')
         toolkit.add_resource('theme/assets', 'ckanext-graph')
 
+    ## IBlueprint
+    def get_blueprint(self):
+        return routes.blueprints
+
+    ## IClick
+    def get_commands(self):
+        return cli.get_commands()
+
+    ## ITemplateHelpers
+    def get_helpers(self):
+        return {
+            'graph_snapshot_url': self.snapshot_url,
+            'graph_date_field_options': self.date_field_options,
+        }
+
+    @staticmethod
+    def snapshot_url(view_id):
+        """
+        Get the url of the static SVG snapshot of a graph view, for use in embeds and
+        previews.
+
+        :param view_id: the id of the resource view
+        :returns: the url
+        """
+        return toolkit.url_for('graph.snapshot', view_id=view_id)
+
+    @staticmethod
+    def date_field_options():
+        """
+        Get the options for the date field dropdown in the view form. This profiles
+        every field in the current resource, so it's a helper rather than a template
+        variable to avoid doing it when the view is only being displayed.
+
+        :returns: a list of dropdown options
+        """
+        dropdown_options_date = [
+            {'value': field_name, 'text': field_name}
+            for field_name, field_profile in profile.get_field_profiles().items()
+            if field_profile.is_temporal
+        ]
+        return [None] + sorted(dropdown_options_date, key=lambda x: x['text'])
+
     ## IResourceView
     def info(self):
         return {
@@ -55,7 +99,7 @@ class GraphPlugin(SingletonPlugin):
                     is_date_castable,
                     in_list(self.datastore_field_names),
                 ],
-                'date_interval': [not_empty, in_list(DATE_INTERVALS)],
+                'date_interval': [ignore_empty, in_list(DATE_INTERVALS)],
                 'show_count': [is_boolean],
                 'count_field': [ignore_empty, in_list(self.datastore_field_names)],
                 'count_label': [],
@@ -63,6 +107,8 @@ class GraphPlugin(SingletonPlugin):
             'icon': 'bar-chart',
             'iframed': False,
             'filterable': True,
+            # CKAN's preview renders the full javascript view, so previews stay off;
+            # embeds and previews can use the static snapshot from graph_snapshot_url
             'preview_enabled': False,
             'full_page_edit': False,
         }
@@ -99,30 +145,19 @@ class GraphPlugin(SingletonPlugin):
         :param data_dict:
         """
 
-        datastore_fields = utils.get_datastore_field_types()
+        datastore_fields = profile.get_field_types()
         self.datastore_field_names = datastore_fields.keys()
 
         dropdown_options_count = [
-            {'value': field_name, 'text': field_name}
-            for field_name, field_type in datastore_fields.items()
-        ]
-
-        dropdown_options_date = [
-            {'value': field_name, 'text': field_name}
-            for field_name, field_type in datastore_fields.items()
-            if field_type in TEMPORAL_FIELD_TYPES
-            or 'date' in field_name.lower()
-            or 'time' in field_name.lower()
+            {'value': field_name, 'text': field_name} for field_name in datastore_fields
         ]
 
         vars = {
             'count_field_options': [None]
             + sorted(dropdown_options_count, key=lambda x: x['text']),
-            'date_field_options': [None]
-            + sorted(dropdown_options_date, key=lambda x: x['text']),
-            'date_interval_options': [
-                {'value': interval, 'text': interval} for interval in DATE_INTERVALS
-            ],
+            # the empty option lets the backend choose an interval
+            'date_interval_options': [None]
+            + [{'value': interval, 'text': interval} for interval in DATE_INTERVALS],
             'defaults': {},
             'graphs': [],
             'resource': data_dict['resource'],
@@ -139,6 +174,7 @@ class GraphPlugin(SingletonPlugin):
 
             if records:
                 count_dict = {
+                    'type': 'count',
                     'title': data_dict['resource_view'].get('count_label', None)
                     or count_field,
                     'data': [],
@@ -167,19 +203,23 @@ class GraphPlugin(SingletonPlugin):
             date_field = data_dict['resource_view'].get('date_field')
 
             date_query = Query.new(date_field=date_field, date_interval=date_interval)
+            date_interval = date_query.date_interval
 
-            records = date_query.run()
+            series = DateSeries(date_query.iterate())
 
-            if records:
+            if series:
                 default_options = {
                     'grid': {'hoverable': True, 'clickable': True},
                     'xaxis': {'mode': 'time'},
                     'yaxis': {'tickDecimals': 0},
                 }
 
+                # the data is encoded straight from the series, so the template doesn't
+                # need to dump it to JSON again
                 total_dict = {
+                    'type': 'date',
                     'title': 'Total records',
-                    'data': [],
+                    'data': series.encode_totals(),
                     'options': {
                         'series': {'lines': {'show': True}, 'points': {'show': True}},
                         '_date_interval': date_interval,
@@ -187,8 +227,9 @@ class GraphPlugin(SingletonPlugin):
                 }
 
                 count_dict = {
+                    'type': 'date',
                     'title': 'Per %s' % date_interval,
-                    'data': [],
+                    'data': series.encode_counts(),
                     'options': {
                         'series': {
                             'bars': {'show': True, 'barWidth': 0.6, 'align': 'center'}
@@ -199,16 +240,6 @@ class GraphPlugin(SingletonPlugin):
                 total_dict['options'].update(default_options)
                 count_dict['options'].update(default_options)
 
-                total = 0
-
-                for record in records:
-                    # Convert to string, and then parse as dates
-                    # This works for all date and string fields
-                    timestamp, count = record
-                    total += count
-                    total_dict['data'].append([timestamp, total])
-                    count_dict['data'].append([timestamp, count])
-
                 vars['graphs'].append(total_dict)
                 vars['graphs'].append(count_dict)
 
@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-graph
+# Created by the Natural History Museum in London, UK
+
+from . import snapshot
+
+blueprints = [snapshot.blueprint]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-graph
+# Created by the Natural History Museum in London, UK
+
+from ckan.plugins import toolkit
+from flask import Blueprint, send_file
+
+from ckanext.graph.lib import snapshot as snapshot_lib
+
+blueprint = Blueprint(name='graph', import_name=__name__, url_prefix='/graph')
+
+
+@blueprint.route('/snapshot/<view_id>.svg')
+def snapshot(view_id):
+    """
+    Serve the static SVG snapshot of a graph view. If the snapshot is out of date, it's
+    re-rendered in the background and the previous snapshot is served meanwhile; if
+    there isn't one at all yet, a 404 is returned.
+
+    :param view_id: the id of the resource view
+    """
+    try:
+        resource_view = toolkit.get_action('resource_view_show')({}, {'id': view_id})
+        resource = toolkit.get_action('resource_show')(
+            {}, {'id': resource_view['resource_id']}
+        )
+    except (toolkit.ObjectNotFound, toolkit.NotAuthorized):
+        return toolkit.abort(404, toolkit._('Resource view not found'))
+
+    if resource_view['view_type'] != 'graph':
+        return toolkit.abort(404, toolkit._('Resource view not found'))
+
+    path = snapshot_lib.request_snapshot(resource_view, resource)
+    if path is None:
+        return toolkit.abort(404, toolkit._('Snapshot not available'))
+
+    return send_file(path, mimetype='image/svg+xml')
@@ -41,9 +41,48 @@ Date.locale = {
   },
 };
 
+// a single tooltip element shared by every graph on the page
+var graphTooltip = null;
+
+function getGraphTooltip() {
+  if (graphTooltip === null) {
+    graphTooltip = $("<div id='graph-tooltip'></div>").appendTo('body');
+  }
+  return graphTooltip;
+}
+
+// a single observer that draws each graph the first time it scrolls into view
+var graphObserver = null;
+
+function observeGraph(el, draw) {
+  if (!('IntersectionObserver' in window)) {
+    draw();
+    return;
+  }
+  if (graphObserver === null) {
+    graphObserver = new IntersectionObserver(
+      function (entries) {
+        entries.forEach(function (entry) {
+          if (entry.isIntersecting) {
+            graphObserver.unobserve(entry.target);
+            $(entry.target).trigger('graph:draw');
+          }
+        });
+      },
+      { rootMargin: '200px' },
+    );
+  }
+  el.one('graph:draw', draw);
+  graphObserver.observe(el[0]);
+}
+
 ckan.module('graph', function (jQuery, _) {
   return {
     initialize: function () {
+      observeGraph(this.el, jQuery.proxy(this.draw, this));
+    },
+
+    draw: function () {
       var date_interval = this.options.config['_date_interval'];
 
       var intervals = {
@@ -55,6 +94,7 @@ ckan.module('graph', function (jQuery, _) {
       $.plot(this.el, [this.options.data], this.options.config);
 
       this.el.bind('plothover', function (event, pos, item) {
+        var tooltip = getGraphTooltip();
         if (item) {
           var d = new Date(item.datapoint[0]);
 
@@ -73,25 +113,14 @@ ckan.module('graph', function (jQuery, _) {
             label.reverse().join('-') +
             ':</strong> ' +
             item.datapoint[1];
-          $('#tooltip')
+          tooltip
             .html(content)
             .css({ top: item.pageY - 40, left: item.pageX - 40 })
             .fadeIn(200);
         } else {
-          $('#tooltip').hide();
+          tooltip.hide();
         }
       });
-
-      $("<div id='tooltip'></div>")
-        .css({
-          position: 'absolute',
-          display: 'none',
-          border: '1px solid #fdd',
-          padding: '2px',
-          'background-color': '#fee',
-          opacity: 0.8,
-        })
-        .appendTo('body');
     },
   };
 });
@@ -0,0 +1,264 @@
+"""
+Offline load test for the graph view.
+
+The datastore backend is replaced by FakeBackend, which answers vds_multi_direct and
+datastore_search locally with synthetic responses after a configurable delay, so no
+elasticsearch cluster is needed. This is skipped unless CKANEXT_GRAPH_LOAD_TEST is set;
+run it with -s to see the report, e.g.:
+
+    CKANEXT_GRAPH_LOAD_TEST=1 pytest -s tests/test_load.py
+"""
+
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import pytest
+from ckan import model
+from ckan.plugins import toolkit
+from ckan.tests import factories
+
+from ckanext.graph.lib import profile
+
+REQUESTS = int(os.environ.get('CKANEXT_GRAPH_LOAD_REQUESTS', 200))
+CONCURRENCY = int(os.environ.get('CKANEXT_GRAPH_LOAD_CONCURRENCY', 8))
+LATENCY = float(os.environ.get('CKANEXT_GRAPH_LOAD_LATENCY', 0.05))
+BUCKETS = int(os.environ.get('CKANEXT_GRAPH_LOAD_BUCKETS', 1000))
+
+# 2000-01-01 and one day, in milliseconds
+START = 946684800000
+INTERVAL = 86400000
+
+pytestmark = [
+    pytest.mark.skipif(
+        not os.environ.get('CKANEXT_GRAPH_LOAD_TEST'),
+        reason='set CKANEXT_GRAPH_LOAD_TEST to run the load test',
+    ),
+    pytest.mark.ckan_config('ckan.plugins', 'graph'),
+    pytest.mark.usefixtures('with_plugins', 'clean_db'),
+]
+
+
+class FakeBackend(object):
+    """
+    A local stand-in for the datastore actions the graph view uses.
+    """
+
+    def __init__(self, field_types, latency=0.0, buckets=100, terms=10):
+        """
+        :param field_types: a dict of {field_name: field_type} to report
+        :param latency: seconds to wait before answering each call
+        :param buckets: the number of buckets to return for date histograms
+        :param terms: the number of buckets to return for terms aggregations
+        """
+        self.field_types = field_types
+        self.latency = latency
+        self.buckets = buckets
+        self.terms = terms
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _record(self, action):
+        with self._lock:
+            self.calls[action] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _aggregate(self, aggs):
+        """
+        Build a synthetic response for the given aggregations, recursing into
+        sub-aggregations.
+
+        :param aggs: the aggs dict from a search
+        :returns: a dict shaped like an elasticsearch aggregations response
+        """
+        results = {}
+        for name, agg in aggs.items():
+            if 'terms' in agg:
+                buckets = [
+                    {'key': f'value {i}', 'doc_count': self.terms - i}
+                    for i in range(self.terms)
+                ]
+                results[name] = {'buckets': buckets}
+            elif 'date_histogram' in agg:
+                buckets = [
+                    {'key': START + i * INTERVAL, 'doc_count': i % 10}
+                    for i in range(self.buckets)
+                ]
+                results[name] = {'buckets': buckets}
+            elif 'filter' in agg or 'sampler' in agg:
+                results[name] = {'doc_count': self.buckets}
+                results[name].update(self._aggregate(agg.get('aggs', {})))
+            elif 'min' in agg:
+                results[name] = {'value': START}
+            elif 'max' in agg:
+                results[name] = {'value': START + self.buckets * INTERVAL}
+            else:
+                results[name] = {'value': self.buckets}
+        return results
+
+    def vds_multi_direct(self, context, data_dict):
+        self._record('vds_multi_direct')
+        return {'aggregations': self._aggregate(data_dict['search'].get('aggs', {}))}
+
+    def datastore_search(self, context, data_dict):
+        self._record('datastore_search')
+        fields = [{'id': k, 'type': v} for k, v in self.field_types.items()]
+        return {'fields': fields, 'records': [], 'total': 0}
+
+    @contextmanager
+    def installed(self):
+        """
+        Replace the real actions with this backend's for the duration of the context.
+        """
+        get_action = toolkit.get_action
+        fakes = {
+            'vds_multi_direct': self.vds_multi_direct,
+            'datastore_search': self.datastore_search,
+        }
+
+        def _get_action(name):
+            return fakes.get(name) or get_action(name)
+
+        with patch.object(toolkit, 'get_action', _get_action):
+            yield self
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+
+    :param values: a sorted list of numbers
+    :param p: the percentile, between 0 and 100
+    :returns: the value at that percentile
+    """
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _send(flask_app, url, requests, concurrency):
+    """
+    Request the url concurrently and time each request.
+
+    :param flask_app: the flask app to send requests to
+    :param url: the url to request
+    :param requests: the total number of requests to make
+    :param concurrency: the number of threads to make them from
+    :returns: the total elapsed time and a list of (latency, status code) tuples
+    """
+    local = threading.local()
+
+    def _request(_):
+        if not hasattr(local, 'client'):
+            local.client = flask_app.test_client()
+        start = time.perf_counter()
+        response = local.client.get(url)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_request, range(requests)))
+    return time.perf_counter() - start, results
+
+
+def run_load(flask_app, url, requests, concurrency):
+    """
+    Request the url concurrently, timing each request. Memory is measured in a
+    separate pass afterwards, as tracing allocations slows every request down and
+    would skew the timings.
+
+    :param flask_app: the flask app to send requests to
+    :param url: the url to request
+    :param requests: the total number of requests to make
+    :param concurrency: the number of threads to make them from
+    :returns: a dict of results
+    """
+    elapsed, results = _send(flask_app, url, requests, concurrency)
+
+    tracemalloc.start()
+    try:
+        _send(flask_app, url, concurrency, concurrency)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status != 200),
+        'throughput': requests / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'peak_memory': peak_memory,
+    }
+
+
+def test_graph_view_load(app):
+    backend = FakeBackend(
+        {'created': 'date', 'type': 'text'}, latency=LATENCY, buckets=BUCKETS
+    )
+
+    resource = factories.Resource(datastore_active=True)
+    view = model.ResourceView(
+        resource_id=resource['id'],
+        title='Graph',
+        view_type='graph',
+        order=0,
+        config={
+            'show_date': True,
+            'date_field': 'created',
+            'date_interval': 'day',
+            'show_count': True,
+            'count_field': 'type',
+        },
+    )
+    model.Session.add(view)
+    model.Session.commit()
+
+    with app.flask_app.test_request_context():
+        url = toolkit.url_for(
+            'resource.read',
+            id=resource['package_id'],
+            resource_id=resource['id'],
+            view_id=view.id,
+        )
+
+    profile.clear_cache()
+    with backend.installed():
+        # warm up with a single request, which fetches the field types and profiles the
+        # count field, so the load test only measures the cached path
+        _send(app.flask_app, url, 1, 1)
+        warm_up_calls = Counter(backend.calls)
+        backend.calls.clear()
+        report = run_load(app.flask_app, url, REQUESTS, CONCURRENCY)
+
+    print(
+        f'\n{report["requests"]} requests, {CONCURRENCY} concurrent, '
+        f'{LATENCY * 1000:.0f}ms backend latency, {BUCKETS} buckets'
+    )
+    print(f'throughput: {report["throughput"]:.1f} req/s')
+    print(
+        'latency: '
+        + ', '.join(f'{p} {report[p] * 1000:.1f}ms' for p in ('p50', 'p95', 'p99'))
+    )
+    print(
+        'backend calls: '
+        + ', '.join(f'{k} {v}' for k, v in sorted(backend.calls.items()))
+    )
+    print(
+        f'peak traced memory ({CONCURRENCY} requests): '
+        f'{report["peak_memory"] / 1024 / 1024:.1f}MiB'
+    )
+
+    assert report['errors'] == 0
+    # the first request fetches the field types once and profiles the count field in
+    # one aggregation, alongside the count and date queries
+    assert warm_up_calls == Counter({'datastore_search': 1, 'vds_multi_direct': 3})
+    # after that, the field types and profiles are cached, so each request (in both the
+    # timed and the memory pass) only runs the count and date queries
+    assert backend.calls == Counter({'vds_multi_direct': 2 * (REQUESTS + CONCURRENCY)})
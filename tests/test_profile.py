@@ -0,0 +1,221 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.graph.lib.profile import (
+    FieldProfile,
+    build_profile_query,
+    clear_cache,
+    get_field_profile,
+    get_field_profiles,
+    parse_profile_results,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+
+class TestBuildProfileQuery(object):
+    def test_date_field(self):
+        query = build_profile_query({'created': 'date'})
+        aggs = query['aggs']
+
+        assert aggs['f0_min'] == {'min': {'field': 'data.created._d'}}
+        assert aggs['f0_max'] == {'max': {'field': 'data.created._d'}}
+        assert 'sample' not in aggs
+
+    def test_text_field(self):
+        query = build_profile_query({'created': 'date', 'collected': 'text'})
+        aggs = query['aggs']
+
+        assert aggs['f1_cardinality'] == {'cardinality': {'field': 'data.collected'}}
+        assert 'f1_min' not in aggs
+        assert 'f1_parsed' in aggs['sample']['aggs']
+        assert 'f1_exists' in aggs['sample']['aggs']
+
+
+class TestParseProfileResults(object):
+    def test_parse(self):
+        field_types = {'created': 'date', 'collected': 'text', 'name': 'text'}
+        aggregations = {
+            'f0_count': {'value': 10},
+            'f0_cardinality': {'value': 4},
+            'f0_min': {'value': 1000},
+            'f0_max': {'value': 2000},
+            'f1_count': {'value': 8},
+            'f1_cardinality': {'value': 8},
+            'f2_count': {'value': 10},
+            'f2_cardinality': {'value': 3},
+            'sample': {
+                'f1_exists': {'doc_count': 8},
+                'f1_parsed': {
+                    'doc_count': 6,
+                    'min': {'value': 500},
+                    'max': {'value': 1500},
+                },
+                'f2_exists': {'doc_count': 10},
+                'f2_parsed': {'doc_count': 0},
+            },
+        }
+
+        profiles = parse_profile_results(field_types, aggregations)
+
+        assert profiles['created'].is_temporal
+        assert profiles['created'].date_range == (1000, 2000)
+        assert profiles['created'].cardinality == 4
+        assert profiles['collected'].is_temporal
+        assert profiles['collected'].parse_rate == 0.75
+        assert profiles['collected'].date_range == (500, 1500)
+        assert not profiles['name'].is_temporal
+        assert profiles['name'].date_range is None
+        assert profiles['name'].cardinality == 3
+
+
+class TestDefaultInterval(object):
+    def test_no_range(self):
+        assert FieldProfile('created', 'date').default_interval == 'day'
+
+    def test_short_range(self):
+        # 10 hours
+        field_profile = FieldProfile('created', 'date', min_value=0, max_value=36000000)
+        assert field_profile.default_interval == 'minute'
+
+    def test_long_range(self):
+        # 50 years
+        field_profile = FieldProfile(
+            'created', 'date', min_value=0, max_value=50 * 365 * 86400000
+        )
+        assert field_profile.default_interval == 'month'
+
+
+def _patch_backend(resource, field_types, search):
+    mock_toolkit = MagicMock(
+        c=MagicMock(resource=resource),
+        config={},
+        get_action=MagicMock(return_value=search),
+    )
+    mock_field_types = MagicMock(return_value=field_types)
+    return (
+        patch('ckanext.graph.lib.profile.toolkit', mock_toolkit),
+        patch('ckanext.graph.lib.profile.get_datastore_field_types', mock_field_types),
+        mock_field_types,
+    )
+
+
+class TestGetFieldProfiles(object):
+    def test_cached_per_version(self):
+        resource = {'id': 'abc', 'last_modified': '2020-01-01'}
+        search = MagicMock(return_value={'aggregations': {'f0_count': {'value': 1}}})
+        patch_toolkit, patch_types, mock_field_types = _patch_backend(
+            resource, {'field1': 'text'}, search
+        )
+
+        with patch_toolkit, patch_types:
+            first = get_field_profiles()
+            second = get_field_profiles()
+            resource['last_modified'] = '2020-01-02'
+            get_field_profiles()
+
+        assert first['field1'] is second['field1']
+        assert first['field1'].count == 1
+        assert search.call_count == 2
+        assert mock_field_types.call_count == 2
+
+    def test_expires(self):
+        resource = {'id': 'abc', 'last_modified': '2020-01-01'}
+        search = MagicMock(return_value={'aggregations': {}})
+        patch_toolkit, patch_types, _ = _patch_backend(
+            resource, {'field1': 'text'}, search
+        )
+
+        with patch_toolkit, patch_types, patch(
+            'ckanext.graph.lib.profile.time.time', MagicMock(side_effect=[0, 10, 4000])
+        ):
+            get_field_profiles()
+            get_field_profiles()
+            get_field_profiles()
+
+        assert search.call_count == 2
+
+    def test_only_requested_fields(self):
+        resource = {'id': 'abc'}
+        search = MagicMock(return_value={'aggregations': {'f0_count': {'value': 3}}})
+        patch_toolkit, patch_types, _ = _patch_backend(
+            resource, {'field1': 'text', 'field2': 'date'}, search
+        )
+
+        with patch_toolkit, patch_types:
+            profiles = get_field_profiles(fields=['field2', 'missing'])
+            # already profiled, so no new search
+            field_profile = get_field_profile('field2')
+
+        assert list(profiles) == ['field2']
+        assert field_profile.count == 3
+        assert search.call_count == 1
+        search_body = search.call_args[0][1]['search']
+        assert list(search_body['aggs']) == [
+            'f0_count',
+            'f0_cardinality',
+            'f0_min',
+            'f0_max',
+        ]
+
+    def test_backend_error(self):
+        resource = {'id': 'abc'}
+        search = MagicMock(side_effect=Exception('timed out'))
+        patch_toolkit, patch_types, _ = _patch_backend(
+            resource, {'field1': 'text', 'field2': 'date'}, search
+        )
+
+        with patch_toolkit, patch_types:
+            profiles = get_field_profiles()
+
+        assert profiles['field1'].field_type == 'text'
+        assert not profiles['field1'].is_temporal
+        assert profiles['field2'].is_temporal
+
+    def test_backend_error_not_cached(self):
+        resource = {'id': 'abc'}
+        search = MagicMock(
+            side_effect=[
+                Exception('timed out'),
+                {
+                    'aggregations': {
+                        'sample': {
+                            'f0_exists': {'doc_count': 2},
+                            'f0_parsed': {
+                                'doc_count': 2,
+                                'min': {'value': 0},
+                                'max': {'value': 36000000},
+                            },
+                        }
+                    }
+                },
+            ]
+        )
+        patch_toolkit, patch_types, _ = _patch_backend(
+            resource, {'collected': 'text'}, search
+        )
+
+        with patch_toolkit, patch_types:
+            failed = get_field_profile('collected')
+            recovered = get_field_profile('collected')
+
+        assert search.call_count == 2
+        assert not failed.is_temporal
+        assert recovered.is_temporal
+        assert recovered.default_interval == 'minute'
+
+    def test_no_fields(self):
+        search = MagicMock()
+        patch_toolkit, patch_types, _ = _patch_backend({'id': 'abc'}, {}, search)
+
+        with patch_toolkit, patch_types:
+            profiles = get_field_profiles()
+
+        assert profiles == {}
+        search.assert_not_called()
@@ -0,0 +1,33 @@
+import json
+
+from ckanext.graph.lib.series import DateSeries, encode_pairs
+
+
+class TestDateSeries(object):
+    def test_empty(self):
+        series = DateSeries()
+
+        assert not series
+        assert series.encode_counts() == '[]'
+        assert series.encode_totals() == '[]'
+
+    def test_encode(self):
+        series = DateSeries(iter([(1000, 2), (2000, 0), (3000, 5)]))
+
+        assert len(series) == 3
+        assert json.loads(series.encode_counts()) == [[1000, 2], [2000, 0], [3000, 5]]
+        assert json.loads(series.encode_totals()) == [[1000, 2], [2000, 2], [3000, 7]]
+
+    def test_extend(self):
+        series = DateSeries([(1000, 1)])
+        series.extend([(2000, 1)])
+
+        assert json.loads(series.encode_totals()) == [[1000, 1], [2000, 2]]
+
+
+class TestEncodePairs(object):
+    def test_matches_json(self):
+        xs = [1, 2, 3]
+        ys = [4, 5, 6]
+
+        assert json.loads(encode_pairs(xs, ys)) == [[1, 4], [2, 5], [3, 6]]
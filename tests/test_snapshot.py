@@ -0,0 +1,308 @@
+import os
+import time
+from array import array
+from contextlib import ExitStack
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.graph.lib import profile, snapshot
+from ckanext.graph.lib.snapshot import (
+    generate_snapshot,
+    get_snapshot_path,
+    remove_orphaned_snapshots,
+    render_svg,
+    request_snapshot,
+)
+
+
+class NotAuthorized(Exception):
+    pass
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+RESOURCE = {'id': 'resource', 'last_modified': '2020-01-01', 'private': True}
+
+RESOURCE_VIEW = {
+    'id': 'view',
+    'resource_id': 'resource',
+    'view_type': 'graph',
+    'show_count': True,
+    'count_field': 'type',
+    'filters': {'colour': ['red']},
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    profile.clear_cache()
+    yield
+    profile.clear_cache()
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """
+    Patch toolkit everywhere the snapshot job uses it with fake actions for a private
+    resource, which only succeed if the auth check is skipped.
+    """
+    searches = []
+
+    def vds_multi_direct(context, data_dict):
+        searches.append(data_dict['search'])
+        return {
+            'aggregations': {
+                'f0_cardinality': {'value': 2},
+                'agg_buckets': {
+                    'query_buckets': {
+                        'buckets': [
+                            {'key': 'a', 'doc_count': 3},
+                            {'key': 'b', 'doc_count': 1},
+                        ]
+                    }
+                },
+            }
+        }
+
+    actions = {
+        'resource_view_show': lambda context, data_dict: RESOURCE_VIEW,
+        'resource_show': lambda context, data_dict: RESOURCE,
+        'datastore_search': lambda context, data_dict: {
+            'fields': [{'id': 'type', 'type': 'text'}]
+        },
+        'vds_multi_direct': vds_multi_direct,
+    }
+
+    def get_action(name):
+        def action(context, data_dict):
+            if not context.get('ignore_auth'):
+                raise NotAuthorized(name)
+            return actions[name](context, data_dict)
+
+        return action
+
+    mock_toolkit = MagicMock(
+        config={'ckanext.graph.snapshot_path': str(tmp_path)},
+        get_action=get_action,
+        ObjectNotFound=ObjectNotFound,
+    )
+    with ExitStack() as stack:
+        for module in ('snapshot', 'profile', 'utils'):
+            stack.enter_context(
+                patch(f'ckanext.graph.lib.{module}.toolkit', mock_toolkit)
+            )
+        stack.enter_context(patch('ckanext.graph.db.toolkit', mock_toolkit))
+        mock_toolkit.searches = searches
+        yield mock_toolkit
+
+
+def _age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+class TestRenderSvg(object):
+    def test_panels(self):
+        panels = [
+            {
+                'title': 'Type <1>',
+                'kind': 'bar',
+                'values': [3, 1],
+                'labels': ['A', 'B'],
+            },
+            {
+                'title': 'Total records',
+                'kind': 'line',
+                'values': [1, 3],
+                'labels': None,
+            },
+        ]
+
+        svg = render_svg(panels)
+
+        assert svg.startswith('<svg')
+        assert 'Type &lt;1&gt;' in svg
+        assert svg.count('<rect') == 2
+        assert '<polyline' in svg
+
+    def test_downsample(self):
+        values = list(range(snapshot.MAX_POINTS * 3))
+        panels = [{'title': 'Per day', 'kind': 'bar', 'values': values, 'labels': None}]
+
+        svg = render_svg(panels)
+
+        assert svg.count('<rect') == snapshot.MAX_POINTS
+
+    def test_downsample_total(self):
+        values = array('q', [1] * (snapshot.MAX_POINTS * 3 + 1))
+        panels = [
+            {'title': 'Total records', 'kind': 'line', 'values': values, 'labels': None}
+        ]
+
+        svg = render_svg(panels)
+
+        # the running total is drawn, so the maximum is the sum of every value
+        assert f'>{len(values)}</text>' in svg
+        assert svg.count(',') <= snapshot.MAX_POINTS
+
+
+class TestGetSnapshotPath(object):
+    def test_not_configured(self):
+        mock_toolkit = MagicMock(config={})
+
+        with patch('ckanext.graph.lib.snapshot.toolkit', mock_toolkit):
+            assert get_snapshot_path({'id': 'view'}, {'id': 'resource'}) is None
+
+    def test_changes_with_version(self):
+        mock_toolkit = MagicMock(config={'ckanext.graph.snapshot_path': '/snapshots'})
+        resource_view = {'id': 'view', 'show_count': True, 'count_field': 'type'}
+
+        with patch('ckanext.graph.lib.snapshot.toolkit', mock_toolkit):
+            first = get_snapshot_path(
+                resource_view, {'id': 'resource', 'last_modified': '2020-01-01'}
+            )
+            second = get_snapshot_path(
+                resource_view, {'id': 'resource', 'last_modified': '2020-01-02'}
+            )
+
+        assert first.startswith('/snapshots/view/')
+        assert first.endswith('.svg')
+        assert first != second
+
+    def test_changes_with_filters(self):
+        mock_toolkit = MagicMock(config={'ckanext.graph.snapshot_path': '/snapshots'})
+        resource_view = {'id': 'view', 'show_count': True, 'count_field': 'type'}
+        filtered_view = dict(resource_view, filters={'colour': ['red']})
+
+        with patch('ckanext.graph.lib.snapshot.toolkit', mock_toolkit):
+            unfiltered = get_snapshot_path(resource_view, RESOURCE)
+            filtered = get_snapshot_path(filtered_view, RESOURCE)
+
+        assert unfiltered != filtered
+
+
+class TestGenerateSnapshot(object):
+    def test_private_resource(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+        open(f'{path}.pending', 'w').close()
+
+        generate_snapshot(RESOURCE_VIEW['id'], path)
+
+        with open(path) as f:
+            assert f.read().count('<rect') == 2
+        assert not os.path.exists(f'{path}.pending')
+
+    def test_saved_filters(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+
+        generate_snapshot(RESOURCE_VIEW['id'], path)
+
+        assert 'colour' in str(backend.searches[-1])
+
+    def test_removes_superseded(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        directory = os.path.dirname(path)
+        os.makedirs(directory)
+        old = os.path.join(directory, 'old.svg')
+        open(old, 'w').close()
+
+        generate_snapshot(RESOURCE_VIEW['id'], path)
+
+        assert os.listdir(directory) == [os.path.basename(path)]
+
+    def test_failure(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+        open(f'{path}.pending', 'w').close()
+
+        with patch(
+            'ckanext.graph.lib.snapshot.get_panels',
+            MagicMock(side_effect=ValueError('bad field')),
+        ):
+            with pytest.raises(ValueError):
+                generate_snapshot(RESOURCE_VIEW['id'], path)
+
+        assert not os.path.exists(path)
+        assert not os.path.exists(f'{path}.pending')
+        assert os.path.exists(f'{path}.failed')
+
+
+class TestRequestSnapshot(object):
+    def test_queues_once(self, backend):
+        assert request_snapshot(RESOURCE_VIEW, RESOURCE) is None
+        assert request_snapshot(RESOURCE_VIEW, RESOURCE) is None
+
+        assert backend.enqueue_job.call_count == 1
+
+    def test_fresh(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+        assert request_snapshot(RESOURCE_VIEW, RESOURCE) == path
+        backend.enqueue_job.assert_not_called()
+
+    def test_expired(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+        _age(path, profile.CACHE_TTL + 1)
+
+        # the old snapshot is served while it is re-rendered
+        assert request_snapshot(RESOURCE_VIEW, RESOURCE) == path
+        assert backend.enqueue_job.call_count == 1
+
+    def test_serves_previous_version(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        directory = os.path.dirname(path)
+        os.makedirs(directory)
+        old = os.path.join(directory, 'old.svg')
+        open(old, 'w').close()
+
+        assert request_snapshot(RESOURCE_VIEW, RESOURCE) == old
+        assert backend.enqueue_job.call_count == 1
+
+    def test_stale_pending(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+        open(f'{path}.pending', 'w').close()
+
+        request_snapshot(RESOURCE_VIEW, RESOURCE)
+        backend.enqueue_job.assert_not_called()
+
+        _age(f'{path}.pending', snapshot.PENDING_TTL + 1)
+        request_snapshot(RESOURCE_VIEW, RESOURCE)
+        assert backend.enqueue_job.call_count == 1
+
+    def test_recent_failure(self, backend):
+        path = get_snapshot_path(RESOURCE_VIEW, RESOURCE)
+        os.makedirs(os.path.dirname(path))
+        open(f'{path}.failed', 'w').close()
+
+        request_snapshot(RESOURCE_VIEW, RESOURCE)
+        backend.enqueue_job.assert_not_called()
+
+        _age(f'{path}.failed', profile.CACHE_TTL + 1)
+        request_snapshot(RESOURCE_VIEW, RESOURCE)
+        assert backend.enqueue_job.call_count == 1
+
+
+class TestRemoveOrphanedSnapshots(object):
+    def test_remove(self, backend, tmp_path):
+        os.makedirs(tmp_path / 'view')
+        os.makedirs(tmp_path / 'deleted')
+
+        def resource_view_show(context, data_dict):
+            if data_dict['id'] != 'view':
+                raise ObjectNotFound()
+            return RESOURCE_VIEW
+
+        backend.get_action = MagicMock(return_value=resource_view_show)
+
+        assert remove_orphaned_snapshots() == 1
+        assert os.listdir(tmp_path) == ['view']
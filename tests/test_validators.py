@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ckanext.graph.lib.profile import FieldProfile
+from ckanext.graph.logic.validators import is_date_castable
+
+
+class Invalid(Exception):
+    pass
+
+
+def _mock_toolkit(total):
+    return MagicMock(
+        Invalid=Invalid,
+        c=MagicMock(resource={'id': 'abc'}),
+        get_action=MagicMock(return_value=MagicMock(return_value={'total': total})),
+    )
+
+
+class TestIsDateCastable(object):
+    def test_empty(self):
+        assert is_date_castable('', {}) == ''
+
+    def test_temporal_profile(self):
+        mock_toolkit = _mock_toolkit(0)
+        mock_profile = MagicMock(
+            return_value=FieldProfile('created', 'text', parse_rate=0.5)
+        )
+
+        with patch('ckanext.graph.logic.validators.toolkit', mock_toolkit), patch(
+            'ckanext.graph.logic.validators.profile.get_field_profile', mock_profile
+        ):
+            assert is_date_castable('created', {}) == 'created'
+
+        # the sample found dates, so no full scan is needed
+        mock_toolkit.get_action.assert_not_called()
+
+    def test_sparse_dates(self):
+        # the sample found no dates, but the full scan does
+        mock_toolkit = _mock_toolkit(1)
+        mock_profile = MagicMock(return_value=FieldProfile('created', 'text'))
+
+        with patch('ckanext.graph.logic.validators.toolkit', mock_toolkit), patch(
+            'ckanext.graph.logic.validators.profile.get_field_profile', mock_profile
+        ):
+            assert is_date_castable('created', {}) == 'created'
+
+        mock_toolkit.get_action.assert_called_once_with('datastore_search_raw')
+
+    def test_no_dates(self):
+        mock_toolkit = _mock_toolkit(0)
+        mock_profile = MagicMock(return_value=FieldProfile('name', 'text'))
+
+        with patch('ckanext.graph.logic.validators.toolkit', mock_toolkit), patch(
+            'ckanext.graph.logic.validators.profile.get_field_profile', mock_profile
+        ):
+            with pytest.raises(Invalid):
+                is_date_castable('name', {})
+
+    def test_missing_field(self):
+        mock_toolkit = _mock_toolkit(1)
+        mock_profile = MagicMock(return_value=None)
+
+        with patch('ckanext.graph.logic.validators.toolkit', mock_toolkit), patch(
+            'ckanext.graph.logic.validators.profile.get_field_profile', mock_profile
+        ):
+            with pytest.raises(Invalid):
+                is_date_castable('missing', {})